@@ -23,22 +23,160 @@ This module provides classes for supported job types.
 """
 
 
+import io
 import os
+import enum
+import re
 import sys
 import subprocess
 import time
 from subprocess import Popen, PIPE, STDOUT
 
+from .singleton import *
+
+# Job environment report written at the start of every job script
+
+ECHO_LINES = (
+    'echo "Starting at `date`"',
+    'echo "Running on hosts: $SLURM_NODELIST"',
+    'echo "Running on $SLURM_NNODES nodes."',
+    'echo "Running on $SLURM_NPROCS processors."',
+    'echo "SLURM JobID $SLURM_JOB_ID processors."',
+    'echo "Node has $SLURM_CPUS_ON_NODE processors."',
+    'echo "Node has $SLURM_MEM_PER_NODE total memory."',
+    'echo "Node has $SLURM_MEM_PER_CPU memory per cpu."',
+    'echo "Current working directory is `pwd`"',
+    'echo "Current path is $PATH"',
+)
+
+SCRIPT_TAIL = "\n".join(ECHO_LINES)
+
+class JobState(enum.IntEnum):
+    """SLURM job states"""
+
+    UNKNOWN = 0
+    PENDING = 1
+    CONFIGURING = 2
+    RUNNING = 3
+    SUSPENDED = 4
+    COMPLETING = 5
+    COMPLETED = 6
+    CANCELLED = 7
+    FAILED = 8
+    TIMEOUT = 9
+    NODE_FAIL = 10
+    PREEMPTED = 11
+    BOOT_FAIL = 12
+    DEADLINE = 13
+    OUT_OF_MEMORY = 14
+
+    @classmethod
+    def from_code(cls, code):
+        """Return state for a squeue compact state code (%t)"""
+        return SLURM_STATE_CODES.get(code, cls.UNKNOWN)
+
+
+SLURM_STATE_CODES = {
+    "PD": JobState.PENDING,
+    "CF": JobState.CONFIGURING,
+    "R": JobState.RUNNING,
+    "S": JobState.SUSPENDED,
+    "CG": JobState.COMPLETING,
+    "CD": JobState.COMPLETED,
+    "CA": JobState.CANCELLED,
+    "F": JobState.FAILED,
+    "TO": JobState.TIMEOUT,
+    "NF": JobState.NODE_FAIL,
+    "PR": JobState.PREEMPTED,
+    "BF": JobState.BOOT_FAIL,
+    "DL": JobState.DEADLINE,
+    "OOM": JobState.OUT_OF_MEMORY,
+}
+
+# Notebook/lab url as printed by Jupyter on startup
+
+TOKEN_URL_RE = re.compile(r"https?://\S*\?token=\S+", re.ASCII)
+
+
+@Singleton
+class VMHostWatcher(object):
+    """Watches the user store directory for VM host files.
+
+    VM jobs are registered with the watcher, which dispatches the host
+    name to the job when its vm_host_<id>.ip file has been written. The
+    directory is listed once per poll and matched against all registered
+    jobs.
+    """
+
+    def __init__(self):
+        """Class constructor"""
+        self.store_dir = os.path.join(os.getenv("HOME"), ".lhpc")
+        self.jobs = {}
+
+    def register(self, job):
+        """Register job for notification when host file is written"""
+
+        filename = os.path.basename(job.host_filename)
+        self.jobs[filename] = job
+
+    def unregister(self, job):
+        """Remove job from watcher"""
+        self.jobs.pop(os.path.basename(job.host_filename), None)
+
+    def _check_host_file(self, filename):
+        """Read host file and dispatch to job if it exists"""
+
+        job = self.jobs[filename]
+
+        try:
+            with open(job.host_filename) as f:
+                hostname = f.readline().strip()
+        except FileNotFoundError:
+            return
+
+        if hostname != "":
+            del self.jobs[filename]
+            job.on_host_file(hostname)
+
+    def _scan_store_dir(self):
+        """Return names of all files in store directory"""
+
+        try:
+            with os.scandir(self.store_dir) as entries:
+                return [entry.name for entry in entries]
+        except OSError:
+            return []
+
+    def poll(self):
+        """Dispatch host files written since last poll"""
+
+        if not self.jobs:
+            return
+
+        for filename in self._scan_store_dir():
+            if filename in self.jobs:
+                self._check_host_file(filename)
+
 
 class Job(object):
     """Class describing a SLURM jobs"""
 
+    __slots__ = ("id", "status", "magic", "name", "nodes", "tasksPerNode",
+                 "cpusPerNode", "exclusive", "time", "nodeCount", "memory",
+                 "account", "partition", "node", "submitNode", "constraints",
+                 "gres", "oversubscribe", "module_list", "scriptLines",
+                 "customLines", "timeLeft", "timeRunning", "timeLimit",
+                 "_process_output", "update_processing", "_script", "_dirty",
+                 "_script_key")
+
     def __init__(self, account="", partition="", time="00:60:00"):
         """Initialise default class variables"""
 
-        self.script = ""
         self.id = -1
-        self.status = ""
+        self.status = JobState.UNKNOWN
+        self.timeLeft = ""
+        self.timeRunning = ""
+        self.timeLimit = ""
 
         self.magic = "#!/bin/bash"
         self.name = "gui_interactive"
@@ -64,103 +202,125 @@ class Job(object):
         self._process_output = False
         self.update_processing = False
 
-        self._create_script()
+        self._script = ""
+        self._script_key = None
+        self._dirty = True
 
     def add_constraint(self, constraint):
         """Add constraint (feature)"""
         self.constraints.append(constraint)
+        self._dirty = True
 
     def clear_constraints(self):
         self.constraints = []
+        self._dirty = True
 
     def add_script(self, line):
         self.scriptLines.append(line)
+        self._dirty = True
 
     def add_option(self, option):
-        self.add_script("#SBATCH " + option)
+        self.add_script(f"#SBATCH {option}")
 
     def add_module(self, name, version=""):
-        self.module_list.append([name, version])
+        if version == "":
+            self.module_list.append(f"module load {name}")
+        else:
+            self.module_list.append(f"module load {name}/{version}")
+        self._dirty = True
 
     def clear_script(self):
         self.scriptLines = []
         self.customLines = []
         self.constraints = []
         self.module_list = []
+        self._dirty = True
+
+    def _script_settings(self):
+        """Return tuple of all settings the batch script depends on"""
+        return (self.magic, self.account, self.submitNode, self.node, self.partition,
+                self.nodeCount, self.tasksPerNode, self.time, self.gres, self.memory,
+                self.exclusive, self.oversubscribe, tuple(self.constraints), self.name,
+                tuple(self.module_list), tuple(self.customLines))
 
     def _create_script(self):
+        """Build the batch script from the current job settings"""
 
-        self.scriptLines = []
+        # Skip rebuild if nothing has changed since the last build
+
+        key = self._script_settings()
+
+        if key == self._script_key:
+            self._dirty = False
+            return
+
+        buf = io.StringIO()
+        write = buf.write
 
-        self.add_script(self.magic)
-        self.add_script("")
+        write(self.magic)
+        write("\n\n")
 
         if self.account != "":
-            self.add_option("-A %s" % self.account)
+            write(f"#SBATCH -A {self.account}\n")
 
         if self.submitNode:
-            self.add_option("-w %s" % self.node)
+            write(f"#SBATCH -w {self.node}\n")
         else:
             if self.partition != "":
-                self.add_option("-p %s" % self.partition)
+                write(f"#SBATCH -p {self.partition}\n")
 
         if self.nodeCount >= 0:
-            self.add_option("-N %d" % self.nodeCount)
+            write(f"#SBATCH -N {self.nodeCount}\n")
 
         if self.tasksPerNode >= 0:
-            self.add_option("--ntasks-per-node=%d" % self.tasksPerNode)
+            write(f"#SBATCH --ntasks-per-node={self.tasksPerNode}\n")
 
-        self.add_option("--time=%s" % self.time)
+        write(f"#SBATCH --time={self.time}\n")
 
         if self.gres != "":
-            self.add_option("--gres=%s" % self.gres)
+            write(f"#SBATCH --gres={self.gres}\n")
 
         if self.memory > 0:
-            self.add_option("--mem=%d" % self.memory)
+            write(f"#SBATCH --mem={self.memory}\n")
 
         if self.exclusive:
-            self.add_option("--exclusive")
+            write("#SBATCH --exclusive\n")
 
         if self.oversubscribe:
-            self.add_option("--oversubscribe")
-
-        if len(self.constraints) > 0:
-            if len(self.constraints) == 1:
-                self.add_option("--constraint=%s" % self.constraints[0])
-            else:
-                constraint_string = "&".join(self.constraints)
-                self.add_option("--constraint=%s" % constraint_string)
-
-        self.add_option("-J %s" % self.name)
-        self.add_script("")
-        self.add_script('echo "Starting at `date`"')
-        self.add_script('echo "Running on hosts: $SLURM_NODELIST"')
-        self.add_script('echo "Running on $SLURM_NNODES nodes."')
-        self.add_script('echo "Running on $SLURM_NPROCS processors."')
-        self.add_script('echo "SLURM JobID $SLURM_JOB_ID processors."')
-        self.add_script('echo "Node has $SLURM_CPUS_ON_NODE processors."')
-        self.add_script('echo "Node has $SLURM_MEM_PER_NODE total memory."')
-        self.add_script('echo "Node has $SLURM_MEM_PER_CPU memory per cpu."')
-        self.add_script('echo "Current working directory is `pwd`"')
-        self.add_script('echo "Current path is $PATH"')
-        self.add_script('')
-
-        for module in self.module_list:
-            module_name = module[0]
-            module_version = module[1]
-
-            if module_version == "":
-                self.add_script('module load %s' % (module_name))
-            else:
-                self.add_script('module load %s/%s' % (module_name, module_version))
-
-        self.script = "\n".join(self.scriptLines + self.customLines)
+            write("#SBATCH --oversubscribe\n")
+
+        if self.constraints:
+            write(f"#SBATCH --constraint={'&'.join(self.constraints)}\n")
+
+        write(f"#SBATCH -J {self.name}\n\n")
+        write(SCRIPT_TAIL)
+        write("\n")
+
+        for line in self.module_list:
+            write("\n")
+            write(line)
+
+        for line in self.customLines:
+            write("\n")
+            write(line)
+
+        self._script = buf.getvalue()
+        self._script_key = key
+        self._dirty = False
 
     def add_custom_script(self, line):
         self.customLines.append(line)
+        self._dirty = True
 
     def update(self):
-        self._create_script()
+        """Mark script for rebuild after job attributes have been changed"""
+        self._dirty = True
+
+    def get_script(self):
+        """Return batch script, rebuilding it if settings have changed"""
+        if self._dirty:
+            self._create_script()
+        return self._script
 
     def set_process_output(self, flag):
         self._process_output = flag
@@ -177,37 +337,47 @@ class Job(object):
     def __str__(self):
         return self.script
 
+    script = property(get_script)
     process_output = property(get_process_output, set_process_output)
 
 
 class PlaceHolderJob(Job):
     """Placeholder job running acting as master process"""
 
+    __slots__ = ()
+
     def __init__(self, account="", partition="", time="00:30:00"):
         Job.__init__(self, account, partition, time)
         self.add_custom_script('while true; do date; sleep 5; done')
-        self.update()
 
 
-class JupyterNotebookJob(Job):
-    """Jupyter notebook job"""
+class JupyterJob(Job):
+    """Base class for Jupyter notebook and lab jobs"""
 
-    def __init__(self, account="", partition="", time="00:30:00", notebook_module="Anaconda3"):
+    __slots__ = ("notebook_url", "url_found_callback")
+
+    LAUNCH_CMD = ""
+    LABEL = ""
+
+    def __init__(self, account="", partition="", time="00:30:00", module="Anaconda3"):
         Job.__init__(self, account, partition, time)
         self.notebook_url = ""
+        self.url_found_callback = None
         self.process_output = True
-        self.notebook_module = notebook_module
 
-        self.add_module(self.notebook_module)
+        self.add_module(module)
 
         self.add_custom_script("unset XDG_RUNTIME_DIR")
-        self.add_custom_script('jupyter-notebook --no-browser --ip=$HOSTNAME')
+        self.add_custom_script(self.LAUNCH_CMD)
         self.add_custom_script("module list")
         self.add_custom_script("which python")
 
     def on_notebook_url_found(self, url):
         """Event method called when notebook has been found"""
-        print("Notebook found: "+url)
+        if self.url_found_callback is not None:
+            self.url_found_callback(url)
+        else:
+            print(f"{self.LABEL} found: {url}")
 
     def do_process_output(self, output_lines):
         """Process job output"""
@@ -216,58 +386,54 @@ class JupyterNotebookJob(Job):
 
         if self.process_output:
             for line in output_lines:
-                if line.find("?token=") != -1:
-                    parts = line.split()
-                    if len(parts) == 4:
-                        self.notebook_url = parts[3]
-                        self.process_output = False
+                if "?token=" not in line:
+                    continue
+                match = TOKEN_URL_RE.search(line)
+                if match is not None:
+                    self.notebook_url = match.group(0)
+                    self.process_output = False
 
-                        self.on_notebook_url_found(self.notebook_url)
+                    self.on_notebook_url_found(self.notebook_url)
+                    break
 
 
-class JupyterLabJob(Job):
-    """Jupyter lab job"""
+class JupyterNotebookJob(JupyterJob):
+    """Jupyter notebook job"""
 
-    def __init__(self, account="", partition="", time="00:30:00", jupyterlab_module="Anaconda3"):
-        Job.__init__(self, account, partition, time)
-        self.notebook_url = ""
-        self.process_output = True
-        self.jupyterlab_module = jupyterlab_module
+    __slots__ = ("notebook_module",)
 
-        self.add_module(self.jupyterlab_module)
+    LAUNCH_CMD = "jupyter-notebook --no-browser --ip=$HOSTNAME"
+    LABEL = "Notebook"
 
-        self.add_custom_script("unset XDG_RUNTIME_DIR")
-        self.add_custom_script('jupyter-lab --no-browser --ip=$HOSTNAME')
-        self.add_custom_script("module list")
-        self.add_custom_script("which python")
+    def __init__(self, account="", partition="", time="00:30:00", notebook_module="Anaconda3"):
+        JupyterJob.__init__(self, account, partition, time, notebook_module)
+        self.notebook_module = notebook_module
 
-    def on_notebook_url_found(self, url):
-        """Event method called when notebook has been found"""
-        print("Lab found: "+url)
 
-    def do_process_output(self, output_lines):
-        """Process job output"""
+class JupyterLabJob(JupyterJob):
+    """Jupyter lab job"""
 
-        Job.do_process_output(self, output_lines)
+    __slots__ = ("jupyterlab_module",)
 
-        if self.process_output:
-            for line in output_lines:
-                if line.find("?token=") != -1:
-                    parts = line.split()
-                    if len(parts) == 4:
-                        self.notebook_url = parts[3]
-                        self.process_output = False
+    LAUNCH_CMD = "jupyter-lab --no-browser --ip=$HOSTNAME"
+    LABEL = "Lab"
 
-                        self.on_notebook_url_found(self.notebook_url)
+    def __init__(self, account="", partition="", time="00:30:00", jupyterlab_module="Anaconda3"):
+        JupyterJob.__init__(self, account, partition, time, jupyterlab_module)
+        self.jupyterlab_module = jupyterlab_module
 
 
 class VMJob(Job):
     """Special Job for starting VM:s"""
 
+    __slots__ = ("_id", "host_filename", "hostname", "notebook_url", "vm_available_callback")
+
     def __init__(self, account="", partition="", time="00:30:00"):
         """Class constructor"""
+        self.host_filename = None
         super().__init__(account, partition, time)
         self.notebook_url = ""
+        self.vm_available_callback = None
         self.process_output = False
         self.update_processing = True
         #self.add_custom_script("sleep infinity")
@@ -279,23 +445,42 @@ class VMJob(Job):
         self.nodeCount = -1
         self.tasksPerNode = -1
 
+    def get_id(self):
+        return self._id
+
+    def set_id(self, job_id):
+        """Assign job id and resolve host file name once it is known"""
+
+        if self.host_filename is not None:
+            VMHostWatcher.create().unregister(self)
+            self.host_filename = None
+
+        self._id = job_id
+
+        if job_id > 0:
+            watcher = VMHostWatcher.create()
+            self.host_filename = os.path.join(
+                watcher.store_dir, f"vm_host_{job_id}.ip")
+            watcher.register(self)
+
     def do_update_processing(self):
         """Check for vm job ip file"""
 
-        home_dir = os.getenv("HOME")
+        if self.host_filename is not None:
+            VMHostWatcher.create().poll()
 
-        store_dir = os.path.join(home_dir, ".lhpc")
-        job_host_filename = os.path.join(
-            store_dir, "vm_host_%s.ip" % str(self.id))
+    def on_host_file(self, hostname):
+        """Called by VMHostWatcher when job ip file has been found."""
 
-        if os.path.exists(job_host_filename):
-            with open(job_host_filename) as f:
-                hostname = f.readlines()[0].strip()
-
-            self.update_processing = False
-            self.hostname = hostname
-            self.on_vm_available(hostname)
+        self.update_processing = False
+        self.hostname = hostname
+        self.on_vm_available(hostname)
 
     def on_vm_available(self, hostname):
         """Callback when job ib file found."""
-        print("VM vailable: "+hostname)
+        if self.vm_available_callback is not None:
+            self.vm_available_callback(hostname)
+        else:
+            print(f"VM vailable: {hostname}")
+
+    id = property(get_id, set_id)
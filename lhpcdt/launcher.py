@@ -577,7 +577,7 @@ class GfxLaunchWindow(QtWidgets.QMainWindow):
             # Create a Jupyter notbook job
 
             self.job = jobs.JupyterNotebookJob(notebook_module=self.notebook_module)
-            self.job.on_notebook_url_found = self.on_notebook_url_found
+            self.job.url_found_callback = self.on_notebook_url_found
 
             # Create extra user interface controls for reconnection
 
@@ -596,7 +596,7 @@ class GfxLaunchWindow(QtWidgets.QMainWindow):
             # Create a Jupyter lab job
 
             self.job = jobs.JupyterLabJob(jupyterlab_module=self.jupyterlab_module)
-            self.job.on_notebook_url_found = self.on_notebook_url_found
+            self.job.url_found_callback = self.on_notebook_url_found
 
             # Create extra user interface controls for reconnection
 
@@ -615,7 +615,7 @@ class GfxLaunchWindow(QtWidgets.QMainWindow):
             # Create a VM job
 
             self.job = jobs.VMJob()
-            self.job.on_vm_available = self.on_vm_available
+            self.job.vm_available_callback = self.on_vm_available
 
             # Create extra user interface for reconnection to VM.
 
@@ -293,13 +293,13 @@ class Slurm(object):
         squeue_output = p.communicate()[0].strip().split(";")
 
         if len(squeue_output) > 1:
-            job.status = squeue_output[0]
+            job.status = jobs.JobState.from_code(squeue_output[0])
             job.nodes = squeue_output[1]
             job.timeLeft = squeue_output[2]
             job.timeRunning = squeue_output[3]
             job.timeLimit = squeue_output[4]
         else:
-            job.status = ""
+            job.status = jobs.JobState.UNKNOWN
             job.nodes = ""
             job.timeLeft = ""
             job.timeRunning = ""
@@ -314,7 +314,7 @@ class Slurm(object):
         """Cancel job"""
         result = subprocess.call("scancel %d" % (job.id), shell=True)
         job.id = -1
-        job.status = ""
+        job.status = jobs.JobState.UNKNOWN
         return result
 
     def job_output(self, job):
@@ -336,23 +336,23 @@ class Slurm(object):
         """Wait for job to start"""
         self.job_status(job)
 
-        while job.status != "R":
+        while job.status is not jobs.JobState.RUNNING:
             time.sleep(1)
             self.job_status(job)
 
     def is_running(self, job):
         self.job_status(job)
-        return job.status == "R"
+        return job.status is jobs.JobState.RUNNING
 
     def has_started(self, job):
         """Query if job has started"""
         self.job_status(job)
-        return job.status == "R"
+        return job.status is jobs.JobState.RUNNING
 
     def is_waiting(self, job):
         """Query if job is in an non-running state"""
         self.job_status(job)
-        return job.status != "R"
+        return job.status is not jobs.JobState.RUNNING
 
 
 if __name__ == "__main__":